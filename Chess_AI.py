@@ -1,33 +1,164 @@
 import random as r
+import time
+import math
+from array import array
 from functools import lru_cache
+import Chess_Engine
 pieceScore = {"K":0, "P":1, "Q":9, "R":5, "B":3, "N":3}
 checkmate = 1000
+MOVETIME = 6 # Seconds findBestMove searches for when it isn't given a limit
+MAX_DEPTH = 30 # Deepest findBestMove searches when it is only limited by time or nodes
+# Counters for the last search, see Chess_Stats. makeMove, undoMove and movesGenerated are the GameState's counters during the search
+searchStats = {"nodes":0, "cutoffs":0, "time":0.0, "depth":0, "score":0, "depthTimes":[], "makeMove":0, "undoMove":0, "movesGenerated":0}
+# Selective search, each one can be switched off for testing
+searchOptions = {"nullMove":True, "lateMoveReductions":True, "futility":True}
+nullMoveReduction = 2
+lateMoveMinimum = 3 # Number of moves searched at full depth before quiet moves are reduced
+futilityMargin = [0, 1.5, 3.5] # Indexed by depth
+razorMargin = 3
+stopEvent = None # Optional threading/multiprocessing Event, the search stops as soon as it is set
+# Monte Carlo tree search
+PLAYOUTS = 300 # Default playouts for findBestMoveMCTS
+nodeBudget = 200000 # Most nodes the tree can hold, the arrays are allocated once at this size
+explorationConstant = 1.4
+virtualLoss = 3 # Visits added along a path while its leaf is being evaluated in parallel mode
+mctsTree = None # Kept between moves so the tree can be reused
+mctsPool = None # Worker processes for parallel MCTS, kept between moves like the tree
 
 def findRandomMove(validMoves):
     return r.choice(validMoves)
 
-def findBestMove():
-    root = node(None, [], None, None)
-    root.developTree(validMoves, gs) #builds the intial tree
-    for i in range(100):
-        makeMoveCount = 0
-        move = root.findBestMove()
-        while len(move.children)!=0:
-            gs.makeMove(move.move)
-            makeMoveCount += 1
-            move = move.findBestMove()
-            move.developTree(gs.getValidMoves(), gs)
-            for j in range(makeMoveCount): gs.undoMove()            
-    
-    return root.findBestMove().move
+def resetSearchStats(gs):
+    global searchStartCounts
+    for key in searchStats:
+        searchStats[key] = 0
+    searchStats["time"] = 0.0
+    searchStats["depthTimes"] = [] # Time taken to complete each depth
+    searchStartCounts = (gs.makeMoveCalls, gs.undoMoveCalls, gs.movesGenerated)
 
+def finishSearchStats(gs, startTime):
+    searchStats["time"] = time.perf_counter() - startTime
+    searchStats["makeMove"] = gs.makeMoveCalls - searchStartCounts[0]
+    searchStats["undoMove"] = gs.undoMoveCalls - searchStartCounts[1]
+    searchStats["movesGenerated"] = gs.movesGenerated - searchStartCounts[2]
+
+# Iterative deepening alpha-beta search. Stops early after movetime seconds or nodes nodes
+# and returns the best move of the last depth that was completed. Searches for MOVETIME seconds if no limit is given.
+def findBestMove(gs, validMoves, depth=None, movetime=None, nodes=None):
+    global deadline, nodeLimit, stopSearch
+    if depth is None and movetime is None and nodes is None: movetime = MOVETIME
+    if depth is None: depth = MAX_DEPTH
+    resetSearchStats(gs)
+    startTime = time.perf_counter()
+    deadline = startTime + movetime if movetime is not None else None
+    nodeLimit = nodes
+    stopSearch = False
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    moves = orderMoves(validMoves)
+    bestMove = moves[0] if len(moves) != 0 else None
+    for currentDepth in range(1, depth+1):
+        move, score = searchRoot(gs, moves, currentDepth, turnMultiplier)
+        if stopSearch: break
+        bestMove = move
+        searchStats["depth"] = currentDepth
+        searchStats["depthTimes"].append(round(time.perf_counter() - startTime, 5))
+        searchStats["score"] = round(score*turnMultiplier, 5) # From white's point of view like scoreBoard
+        moves.remove(move)
+        moves.insert(0, move) # Search the best move first at the next depth
+        if abs(score) >= checkmate: break
+    finishSearchStats(gs, startTime)
+    return bestMove
+
+def searchRoot(gs, moves, depth, turnMultiplier):
+    alpha = -checkmate-1
+    bestMove = moves[0]
+    for move in moves:
+        gs.makeMove(move)
+        score = -negaMax(gs, depth-1, -checkmate-1, -alpha, -turnMultiplier, True)
+        gs.undoMove()
+        if stopSearch: break
+        if score > alpha:
+            alpha = score
+            bestMove = move
+    return bestMove, alpha
+
+# Returns the score of the position from the point of view of the side to move
+def negaMax(gs, depth, alpha, beta, turnMultiplier, allowNull):
+    global stopSearch
+    searchStats["nodes"] += 1
+    if (nodeLimit is not None and searchStats["nodes"] >= nodeLimit) or (deadline is not None and time.perf_counter() >= deadline) \
+            or (stopEvent is not None and stopEvent.is_set()):
+        stopSearch = True
+    if stopSearch: return 0
+    if gs.positionCounts[gs.boardLog[-1]] >= 3 or gs.halfmoveClock >= 100: return 0
+    if depth <= 0:
+        return turnMultiplier*scoreBoard(gs)
+    # Razoring and null moves are tried before generating moves as that is the expensive part
+    inCheck = gs.inCheck()
+    staticScore = None
+    if searchOptions["futility"] and not inCheck and depth < len(futilityMargin):
+        staticScore = turnMultiplier*scoreBoard(gs)
+        # Razoring - far below alpha one move from the leaves, a quiet move won't save it
+        if depth == 1 and staticScore + razorMargin <= alpha:
+            return staticScore
+    # Null move - if passing still beats beta, a real move almost certainly will too
+    if searchOptions["nullMove"] and allowNull and not inCheck and depth >= nullMoveReduction and hasPieces(gs):
+        gs.makeNullMove()
+        score = -negaMax(gs, depth-1-nullMoveReduction, -beta, -beta+1, -turnMultiplier, False)
+        gs.undoNullMove()
+        if score >= beta and not stopSearch:
+            searchStats["cutoffs"] += 1
+            return beta
+    validMoves = gs.getValidMoves()
+    if len(validMoves) == 0:
+        return turnMultiplier*scoreBoard(gs)
+    moveCount = 0
+    for move in orderMoves(validMoves):
+        quiet = move.pieceCaptured == "--" and not move.isPawnPromotion
+        gs.makeMove(move)
+        givesCheck = gs.checkLog[-1]
+        # Futility - quiet moves can't raise a position this far below alpha near the leaves
+        if staticScore is not None and quiet and not givesCheck and moveCount > 0 and staticScore + futilityMargin[depth] <= alpha:
+            gs.undoMove()
+            continue
+        # Late move reductions - quiet moves ordered late are searched shallower first
+        if searchOptions["lateMoveReductions"] and quiet and not inCheck and not givesCheck and depth >= 2 and moveCount >= lateMoveMinimum:
+            score = -negaMax(gs, depth-2, -alpha-1, -alpha, -turnMultiplier, True)
+            if score > alpha:
+                score = -negaMax(gs, depth-1, -beta, -alpha, -turnMultiplier, True)
+        else:
+            score = -negaMax(gs, depth-1, -beta, -alpha, -turnMultiplier, True)
+        gs.undoMove()
+        moveCount += 1
+        if stopSearch: return 0
+        if score > alpha:
+            alpha = score
+        if alpha >= beta:
+            searchStats["cutoffs"] += 1
+            break
+    return alpha
+
+# Captures first, most valuable victim by least valuable attacker, then the other moves as generated
+def orderMoves(moves):
+    return sorted(moves, key=lambda move: -((pieceScore[move.pieceCaptured[1]]*10 - pieceScore[move.pieceMoved[1]] if move.pieceCaptured != "--" else 0)
+                                           + (100 if move.isPawnPromotion else 0)))
+
+# Whether the side to move has anything other than pawns, null moves are unsafe in pawn endgames (zugzwang)
+def hasPieces(gs):
+    colour = "w" if gs.whiteToMove else "b"
+    for row in gs.board:
+        for square in row:
+            if square[0] == colour and square[1] in "QRBN":
+                return True
+    return False
 
 def scoreBoard(gs):
     if gs.checkmate:
         if gs.whiteToMove: return -checkmate # Black wins
-        else: checkmate # White wins
+        else: return checkmate # White wins
     elif gs.stalemate: return 0
     elif gs.repetition: return 0
+    elif gs.fiftyMoveRule: return 0
     squareStrength = [0.16, 0.18, 0.2, 0.22, 0.22, 0.2, 0.18, 0.16]
     score = 0
     numberOfPieces = 0
@@ -67,48 +198,224 @@ def pawnChain(board, square, whiteToMove): # Enter square as a tuple
                 numberOfChains+=1
     return numberOfChains
 
-class node():
-    def __init__(self, parent, children, score, move):
-        self.parent = parent
-        self.children = children
-        self.score = score
-        self.move = move
-        
-    def developTree(self, validMoves, gs): # need to do the + and - for b/w
-        maxMoveScore = -9999999
-        for move in validMoves:
-            gs.makeMove(move)
-            score = scoreBoard(gs)
-            gs.undoMove()
-            self.children.append(node(self, [], score, move))
-            if score>maxMoveScore: maxMoveScore = score
-        self.score = maxMoveScore
-
-    def findBestMove(self):
-        maxMove = self.children[0]
-        for move in self.children:
-            if move.score > maxMove.score: maxMove=move
-        return maxMove
-            
-
-
-
 
+# Monte Carlo tree search. The tree is stored in parallel arrays indexed by node instead of one object per node,
+# and the children of a node are stored next to each other so a node only needs its first child and child count.
+# Leaves are scored with scoreBoard rather than random playouts, which would each need hundreds of getValidMoves.
+class MCTSTree():
+    def __init__(self, size):
+        self.size = size
+        self.visits = array("i", [0])*size
+        self.valueSums = array("d", [0.0])*size # From the point of view of the player who made the move into the node
+        self.firstChild = array("i", [0])*size
+        self.childCount = array("i", [0])*size # 0 for leaves, -1 for game over
+        self.packedMove = array("i", [0])*size
+        self.nodeCount = 1 # Node 0 is the root
+        self.rootKey = None # Position key and length of the move log at the root, for reusing the tree
+        self.rootPly = 0
 
+    def selectChild(self, parent):
+        first = self.firstChild[parent]
+        logVisits = math.log(self.visits[parent] or 1)
+        bestChild, bestValue = first, -1.0
+        for child in range(first, first + self.childCount[parent]):
+            visits = self.visits[child]
+            if visits == 0: return child
+            value = self.valueSums[child]/visits + explorationConstant*math.sqrt(logVisits/visits)
+            if value > bestValue: bestChild, bestValue = child, value
+        return bestChild
 
+    # Adds the children of a node if there is room. Returns False if there wasn't
+    def expand(self, parent, packedMoves):
+        if self.nodeCount + len(packedMoves) > self.size: return False
+        first = self.nodeCount
+        for i in range(len(packedMoves)):
+            self.visits[first+i] = 0
+            self.valueSums[first+i] = 0.0
+            self.childCount[first+i] = 0
+            self.packedMove[first+i] = packedMoves[i]
+        self.firstChild[parent] = first
+        self.childCount[parent] = len(packedMoves)
+        self.nodeCount += len(packedMoves)
+        return True
 
+    # value is from the point of view of the player who made the move into the last node of the path
+    def backpropagate(self, path, value):
+        for node in reversed(path):
+            self.visits[node] += 1
+            self.valueSums[node] += value
+            value = 1 - value
 
+    def bestChild(self):
+        first = self.firstChild[0]
+        return max(range(first, first + self.childCount[0]), key=lambda child: self.visits[child])
 
+    # Returns a new tree holding only the subtree under node, with node as its root
+    def compact(self, node):
+        tree = MCTSTree(self.size)
+        tree.visits[0] = self.visits[node]
+        tree.valueSums[0] = self.valueSums[node]
+        queue = [(node, 0)]
+        for oldNode, newNode in queue: # Breadth first so children stay next to each other
+            count = self.childCount[oldNode]
+            tree.childCount[newNode] = count
+            if count <= 0: continue
+            tree.firstChild[newNode] = tree.nodeCount
+            for i in range(count):
+                oldChild, newChild = self.firstChild[oldNode]+i, tree.nodeCount+i
+                tree.visits[newChild] = self.visits[oldChild]
+                tree.valueSums[newChild] = self.valueSums[oldChild]
+                tree.packedMove[newChild] = self.packedMove[oldChild]
+                queue.append((oldChild, newChild))
+            tree.nodeCount += count
+        return tree
 
 
+def packMove(move):
+    return (move.startRow<<9 | move.startCol<<6 | move.endRow<<3 | move.endCol
+            | move.isEnPassantMove<<12 | move.isCastleMove<<13)
 
+def unpackMove(packed, board):
+    return Chess_Engine.Move((packed>>9 & 7, packed>>6 & 7), (packed>>3 & 7, packed & 7), board,
+                             isEnPassantMove=bool(packed>>12 & 1), isCastleMove=bool(packed>>13 & 1))
 
+# Converts scoreBoard's score (in pawns, white's point of view) into a 0-1 value for the player who just moved
+def scoreToValue(gs):
+    score = scoreBoard(gs)
+    if gs.whiteToMove: score = -score
+    return 1/(1 + 10**max(-20, min(20, -score/4)))
 
+# Generates the moves of the position reached by the path and scores it. Used directly and by the parallel workers
+def evaluateLeaf(gs, packedPath):
+    for packed in packedPath:
+        gs.makeMove(unpackMove(packed, gs.board))
+    moves = gs.getValidMoves()
+    value = scoreToValue(gs)
+    gameOver = len(moves) == 0 or gs.repetition or gs.fiftyMoveRule
+    for packed in packedPath:
+        gs.undoMove()
+    return value, None if gameOver else [packMove(move) for move in moves]
 
+# Reuses the subtree of the last search if the game has only moved forwards since, otherwise starts a new tree
+def getMCTSTree(gs):
+    global mctsTree
+    tree = mctsTree
+    if tree is not None and tree.size == nodeBudget and len(gs.boardLog) == len(gs.moveLog)+1 \
+            and tree.rootPly < len(gs.boardLog) and gs.boardLog[tree.rootPly] == tree.rootKey:
+        node = 0
+        for move in gs.moveLog[tree.rootPly:]:
+            packed = packMove(move)
+            first = tree.firstChild[node]
+            children = [child for child in range(first, first + max(tree.childCount[node], 0)) if tree.packedMove[child] == packed]
+            if len(children) == 0:
+                node = None
+                break
+            node = children[0]
+        if node is not None:
+            tree = tree.compact(node) if node != 0 else tree
+            tree.rootKey, tree.rootPly = gs.boardLog[-1], len(gs.moveLog)
+            mctsTree = tree
+            return tree
+    tree = MCTSTree(nodeBudget)
+    tree.rootKey, tree.rootPly = gs.boardLog[-1], len(gs.moveLog)
+    mctsTree = tree
+    return tree
 
+# Monte Carlo tree search with UCT selection. With workers > 0 leaves are evaluated in that many processes,
+# using virtual losses so the leaves picked for one batch are spread over the tree.
+def findBestMoveMCTS(gs, validMoves, playouts=None, movetime=None, workers=0):
+    if playouts is None: playouts = PLAYOUTS
+    resetSearchStats(gs)
+    startTime = time.perf_counter()
+    deadline = startTime + movetime if movetime is not None else None
+    tree = getMCTSTree(gs)
+    if tree.childCount[0] == 0:
+        tree.expand(0, [packMove(move) for move in validMoves])
+    pool = getMCTSPool(workers) if workers > 0 else None
+    fen = gs.getFen() if pool is not None else None
+    while searchStats["nodes"] < playouts:
+        if (deadline is not None and time.perf_counter() >= deadline) or (stopEvent is not None and stopEvent.is_set()):
+            break
+        if pool is None:
+            runPlayout(tree, gs)
+        else:
+            runPlayoutBatch(tree, pool, fen, min(workers, playouts - searchStats["nodes"]))
+    best = tree.bestChild()
+    value = tree.valueSums[best]/max(tree.visits[best], 1)
+    value = min(max(value, 1e-9), 1-1e-9)
+    searchStats["score"] = round(4*math.log10(value/(1-value))*(1 if gs.whiteToMove else -1), 5)
+    finishSearchStats(gs, startTime)
+    packed = tree.packedMove[best]
+    for move in validMoves:
+        if packMove(move) == packed: return move
 
+def runPlayout(tree, gs):
+    node, path, packedPath = 0, [0], []
+    while tree.childCount[node] > 0:
+        node = tree.selectChild(node)
+        path.append(node)
+        packedPath.append(tree.packedMove[node])
+    searchStats["depth"] = max(searchStats["depth"], len(packedPath))
+    if tree.childCount[node] == -1: # Game over, the value can't change
+        value = tree.valueSums[node]/tree.visits[node]
+    else:
+        value, packedMoves = evaluateLeaf(gs, packedPath)
+        if packedMoves is None: tree.childCount[node] = -1
+        else: tree.expand(node, packedMoves)
+    tree.backpropagate(path, value)
+    searchStats["nodes"] += 1
 
+def runPlayoutBatch(tree, pool, fen, batchSize):
+    batch = []
+    leaves = set()
+    for i in range(batchSize):
+        node, path, packedPath = 0, [0], []
+        while tree.childCount[node] > 0:
+            node = tree.selectChild(node)
+            path.append(node)
+            packedPath.append(tree.packedMove[node])
+        if node in leaves: break # Virtual losses weren't enough to find another leaf
+        if tree.childCount[node] == -1:
+            tree.backpropagate(path, tree.valueSums[node]/tree.visits[node])
+            searchStats["nodes"] += 1
+            continue
+        leaves.add(node)
+        for pathNode in path: tree.visits[pathNode] += virtualLoss # Counted as losses, the value sums stay the same
+        searchStats["depth"] = max(searchStats["depth"], len(packedPath))
+        batch.append((path, pool.submit(evaluateWorkerLeaf, fen, packedPath)))
+    for path, future in batch:
+        value, packedMoves = future.result()
+        for pathNode in path: tree.visits[pathNode] -= virtualLoss
+        node = path[-1]
+        if packedMoves is None: tree.childCount[node] = -1
+        elif tree.childCount[node] == 0: tree.expand(node, packedMoves)
+        tree.backpropagate(path, value)
+        searchStats["nodes"] += 1
 
+# Starts the worker processes the first time and reuses them after, unless the number of workers changes
+def getMCTSPool(workers):
+    global mctsPool
+    if mctsPool is not None and mctsPool._max_workers != workers:
+        shutdownMCTSPool()
+    if mctsPool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        mctsPool = ProcessPoolExecutor(workers)
+    return mctsPool
 
+def shutdownMCTSPool():
+    global mctsPool
+    if mctsPool is not None: mctsPool.shutdown()
+    mctsPool = None
 
+workerFen = None # The root position the worker's GameState is set up for
+workerState = None
 
+# Runs in the worker processes. Only sets the root up again when the search has moved to a new position.
+# The worker doesn't have the game's history, so repetitions before the root aren't seen by parallel searches
+def evaluateWorkerLeaf(fen, packedPath):
+    global workerFen, workerState
+    if fen != workerFen:
+        workerState = Chess_Engine.GameState()
+        workerState.loadFen(fen)
+        workerFen = fen
+    return evaluateLeaf(workerState, packedPath)
@@ -0,0 +1,145 @@
+# This is a headless benchmark of the AI. It runs findBestMove on a fixed set of positions, once to a fixed
+# depth and once for a fixed number of nodes, and prints the results as JSON.
+# Every search is repeated after a warm-up and the fastest time is kept.
+# Save the results of a known good version with --save FILE, then check a change against them with
+# --baseline FILE. The exit status is 1 if the total time got worse by more than the tolerance plus the noise,
+# and 2 if the baseline was saved with different settings.
+
+import argparse
+import json
+import sys
+import Chess_Engine
+import Chess_AI
+import Chess_Stats
+
+positions = {
+    "start": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "italian": "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "middlegame": "r2q1rk1/pp2bppp/2n1pn2/3p4/3P1B2/2PBPN2/PP1N1PPP/R2QK2R w KQ - 2 9",
+    "tactics": "r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1",
+    "endgame": "8/5pk1/6p1/3R4/7P/r5P1/5PK1/8 w - - 0 40",
+    "promotion": "8/4P1k1/8/8/8/8/8/4K3 w - - 0 1", # Quiet promotion, checks move ordering handles promotions without captures
+}
+
+
+def runPosition(name, fen, repeat, depth=None, nodes=None):
+    times = []
+    for i in range(repeat + 1): # The first search only warms up and isn't timed
+        gs = Chess_Engine.GameState()
+        gs.loadFen(fen)
+        validMoves = gs.getValidMoves()
+        if nodes is None:
+            move = Chess_AI.findBestMove(gs, validMoves, depth=depth)
+        else:
+            move = Chess_AI.findBestMove(gs, validMoves, depth=100, nodes=nodes)
+        if i > 0: times.append(Chess_AI.searchStats["time"])
+    # The searches are deterministic, so only the times change between repeats
+    stats = Chess_Stats.getStats(gs, Chess_AI.searchStats)
+    times.sort()
+    return {
+        "name": name,
+        "limit": "depth" if nodes is None else "nodes",
+        "bestmove": move.getChessNotation(),
+        "score": stats["score"],
+        "depth": stats["depth"],
+        "depthTimes": stats["depthTimes"],
+        "nodes": stats["nodes"],
+        "time": round(times[0], 5), # Fastest repeat, the least disturbed by anything else running
+        "medianTime": round(times[len(times)//2], 5),
+        "nps": round(stats["nodes"]/times[0]) if times[0] > 0 else 0,
+    }
+
+
+def runBenchmark(depth, nodes, repeat):
+    results = []
+    for name, fen in positions.items():
+        results.append(runPosition(name, fen, repeat, depth=depth))
+        results.append(runPosition(name, fen, repeat, nodes=nodes))
+    totalNodes = sum([result["nodes"] for result in results])
+    totalTime = sum([result["time"] for result in results])
+    totalMedianTime = sum([result["medianTime"] for result in results])
+    return {
+        "depth": depth,
+        "nodes": nodes,
+        "repeat": repeat,
+        "searchOptions": dict(Chess_AI.searchOptions),
+        "results": results,
+        "totalNodes": totalNodes,
+        "totalTime": round(totalTime, 5),
+        "totalMedianTime": round(totalMedianTime, 5),
+        "nps": round(totalNodes/totalTime) if totalTime > 0 else 0,
+    }
+
+
+# How far apart the repeats were, as a fraction of the fastest time
+def noise(benchmark):
+    return (benchmark["totalMedianTime"] - benchmark["totalTime"])/benchmark["totalTime"] if benchmark["totalTime"] > 0 else 0
+
+
+# Returns the reasons the benchmark and the baseline can't be compared, if they didn't do the same searches
+def differences(benchmark, baseline):
+    reasons = []
+    for setting in ["depth", "nodes", "searchOptions"]:
+        if benchmark[setting] != baseline.get(setting):
+            reasons.append("%s is %s but the baseline used %s" % (setting, benchmark[setting], baseline.get(setting)))
+    names = set([(result["name"], result["limit"]) for result in benchmark["results"]])
+    baselineNames = set([(result["name"], result["limit"]) for result in baseline["results"]])
+    if names != baselineNames:
+        reasons.append("the positions differ from the baseline's")
+    return reasons
+
+
+# Prints how each search compares to the baseline and returns whether the engine got slower overall.
+# Only the total time decides this, single searches are too short to time reliably and are just reported.
+# Searches whose node count changed did different work, so they are left out of the comparison.
+# A slowdown has to be bigger than the tolerance plus the spread between repeats in either run.
+def compare(benchmark, baseline, tolerance, out=sys.stderr):
+    threshold = tolerance + max(noise(benchmark), noise(baseline))
+    baselineResults = {(result["name"], result["limit"]): result for result in baseline["results"]}
+    oldTime = newTime = oldNodes = newNodes = 0
+    for result in benchmark["results"]:
+        old = baselineResults[(result["name"], result["limit"])]
+        if result["nodes"] != old["nodes"]:
+            print("%-10s %-5s nodes %d -> %d, not timed" % (result["name"], result["limit"], old["nodes"], result["nodes"]), file=out)
+            continue
+        oldTime, newTime = oldTime + old["time"], newTime + result["time"]
+        oldNodes, newNodes = oldNodes + old["nodes"], newNodes + result["nodes"]
+        change = (old["time"] - result["time"])/old["time"] if old["time"] > 0 else 0
+        line = "%-10s %-5s time %.3fs -> %.3fs  %+.1f%%" % (result["name"], result["limit"], old["time"], result["time"], change*100)
+        if result["bestmove"] != old["bestmove"]:
+            line += "  bestmove %s -> %s" % (old["bestmove"], result["bestmove"])
+        print(line, file=out)
+    if oldTime == 0 or newTime == 0:
+        print("no searches did the same work as the baseline, nothing to compare", file=out)
+        return False
+    totalChange = (oldTime - newTime)/oldTime
+    regression = totalChange < -threshold
+    print("total time %.3fs -> %.3fs  %+.1f%%  nps %d -> %d  (threshold -%.1f%%)%s" % (oldTime, newTime, totalChange*100,
+          oldNodes/oldTime, newNodes/newTime, threshold*100, "  SLOWER" if regression else ""), file=out)
+    return regression
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the AI's search")
+    parser.add_argument("--depth", type=int, default=3, help="depth for the fixed depth searches")
+    parser.add_argument("--nodes", type=int, default=1000, help="node limit for the fixed node searches")
+    parser.add_argument("--repeat", type=int, default=3, help="times each search is timed after a warm-up search, the fastest counts (default: 3)")
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE to use as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with a baseline saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="fraction the total time may grow by, on top of the spread between repeats, before it counts as a regression (default: 0.05)")
+    args = parser.parse_args()
+
+    benchmark = runBenchmark(args.depth, args.nodes, args.repeat)
+    print(json.dumps(benchmark, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(benchmark, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        reasons = differences(benchmark, baseline)
+        if len(reasons) != 0:
+            print("Can't compare with the baseline, " + "; ".join(reasons), file=sys.stderr)
+            sys.exit(2)
+        if compare(benchmark, baseline, args.tolerance):
+            sys.exit(1)
@@ -26,27 +26,99 @@ class GameState():
         self.checkmate = False
         self.stalemate = False
         self.repetition = False
+        self.fiftyMoveRule = False
         self.enPassantPossible = () # Coords for the square for en passant
         self.enPassantPossibleLog = [self.enPassantPossible]
         self.currentCastlingRights = CastleRights(True, True, True, True)
         self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
                                             self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
-        self.boardLog = [] # For finding repetitions
+        self.boardLog = [self.positionKey()] # For finding repetitions, boardLog[-1] is the current position
+        self.positionCounts = {self.boardLog[-1]: 1} # How many times each position in boardLog has occured
+        self.halfmoveClock = 0 # Moves since the last capture or pawn move, for the fifty move rule
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = 1 # Goes up after every black move, for FEN strings
         self.checkLog = [] # For move notations
+        # Instrumentation counters, read by Chess_Stats
+        self.makeMoveCalls = 0
+        self.undoMoveCalls = 0
+        self.movesGenerated = 0
         
     def __hash__(self):
-        properties = [self.checkmate, self.stalemate, self.repetition]
+        properties = [self.checkmate, self.stalemate, self.repetition, self.fiftyMoveRule]
         properties.append(tuple(map(tuple, self.board)))
         properties.append(self.currentCastlingRights)
         properties.append(self.whiteToMove)
         properties.append(self.enPassantPossible)
         return hash(tuple(properties))
 
-
+    # Sets up the position from a FEN string, clearing the move history
+    def loadFen(self, fen):
+        fields = fen.split()
+        rows = fields[0].split("/") if len(fields) >= 4 else []
+        if len(rows) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        board = []
+        for rowString in rows:
+            row = []
+            for char in rowString:
+                if char.isdigit():
+                    row.extend(["--"]*int(char))
+                elif char.upper() in self.moveFunctions:
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+                else:
+                    raise ValueError("Invalid FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("Invalid FEN: " + fen)
+            board.append(row)
+        self.__init__()
+        self.board = board
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK": self.whiteKingLocation = (row, col)
+                elif board[row][col] == "bK": self.blackKingLocation = (row, col)
+        self.whiteToMove = fields[1] == "w"
+        self.currentCastlingRights = CastleRights("K" in fields[2], "k" in fields[2], "Q" in fields[2], "q" in fields[2])
+        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
+                                            self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
+        if fields[3] != "-":
+            self.enPassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        self.enPassantPossibleLog = [self.enPassantPossible]
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.boardLog = [self.positionKey()]
+        self.positionCounts = {self.boardLog[-1]: 1}
+
+    # Returns the position as a FEN string
+    def getFen(self):
+        rows = []
+        for row in self.board:
+            rowString, empty = "", 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty: rowString += str(empty)
+                empty = 0
+                rowString += piece[1] if piece[0] == "w" else piece[1].lower()
+            rows.append(rowString + (str(empty) if empty else ""))
+        rights = self.currentCastlingRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        enPassant = Move.colsToFiles[self.enPassantPossible[1]] + Move.rowsToRanks[self.enPassantPossible[0]] if self.enPassantPossible else "-"
+        return " ".join(["/".join(rows), "w" if self.whiteToMove else "b", castling or "-", enPassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)])
+
+    # Hash of everything that makes two positions the same for repetitions
+    def positionKey(self):
+        return hash("".join([piece for col in self.board for piece in col])
+                    + "".join([str(i) for i in self.currentCastlingRights.__dict__.values()])
+                    + "".join([str(i) for i in self.enPassantPossible])
+                    + ("w" if self.whiteToMove else "b"))
 
 
 # Takes a move as a parameter and executes it
     def makeMove(self, move):
+        self.makeMoveCalls += 1
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) # Logs move for undos 
@@ -80,10 +152,17 @@ class GameState():
         self.updateCastleRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
                                                 self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+        #update halfmove clock - captures and pawn moves can't be undone so earlier positions can't repeat
+        if move.pieceMoved[1] == "P" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if move.pieceMoved[0] == "b": self.fullmoveNumber += 1
         #update board log
-        self.boardLog.append(hash("".join([piece for col in self.board for piece in col])
-                              + "".join([str(i) for i in self.currentCastlingRights.__dict__.values()])
-                              + "".join([str(i) for i in self.enPassantPossible]))) # For finding repetitions
+        key = self.positionKey()
+        self.boardLog.append(key)
+        self.positionCounts[key] = self.positionCounts.get(key, 0) + 1
         #update check log
         self.checkLog.append(True if self.inCheck() else False)
 
@@ -93,8 +172,16 @@ class GameState():
 
     def undoMove(self):
         if len(self.moveLog) != 0:
+            self.undoMoveCalls += 1
             move = self.moveLog.pop()
-            self.boardLog.pop()
+            key = self.boardLog.pop()
+            if self.positionCounts[key] == 1:
+                del self.positionCounts[key]
+            else:
+                self.positionCounts[key] -= 1
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if move.pieceMoved[0] == "b": self.fullmoveNumber -= 1
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove
@@ -122,10 +209,21 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
             self.repetition = False
+            self.fiftyMoveRule = False
             self.checkLog.pop()
             
 
-        
+    # Passes the turn without moving, for null move pruning in the AI. Not added to the move log
+    def makeNullMove(self):
+        self.whiteToMove = not self.whiteToMove
+        self.enPassantPossible = ()
+        self.enPassantPossibleLog.append(self.enPassantPossible)
+
+    def undoNullMove(self):
+        self.whiteToMove = not self.whiteToMove
+        self.enPassantPossibleLog.pop()
+        self.enPassantPossible = self.enPassantPossibleLog[-1]
+
     def updateCastleRights(self, move): 
         if move.pieceMoved == "wK":
             self.currentCastlingRights.wks = False
@@ -145,14 +243,14 @@ class GameState():
                     self.currentCastlingRights.bqs = False
                 elif move.startCol == 7:
                     self.currentCastlingRights.bks = False
-        # If rook castled
-        if move.pieceCaptured == "wR":
+        # If rook captured
+        if move.pieceCaptured[1] == "R":
             if move.endRow == 7:
-                if move.endCol == 0: self.currentCastleRights.wqs = False
-                elif move.endCol == 7: self.currentCastleRights.wks = False
+                if move.endCol == 0: self.currentCastlingRights.wqs = False
+                elif move.endCol == 7: self.currentCastlingRights.wks = False
             elif move.endRow == 0:
-                if move.endCol == 0: self.currentCastleRights.bqs = False
-                elif move.endCol == 7: self.currentCastleRights.bks = False
+                if move.endCol == 0: self.currentCastlingRights.bqs = False
+                elif move.endCol == 7: self.currentCastlingRights.bks = False
 
 
 
@@ -189,15 +287,13 @@ class GameState():
         else:
             self.checkmate = False # For undoing checkmate/stalemate when we undo moves
             self.stalemate = False
-        #checks for draw by repetition
-        count = 0
-        for transposition in self.boardLog:
-            if transposition == self.boardLog[-1]: count+=1
-        if count>=3: self.repetition = True
-        else: self.repetition = False
+        #checks for draw by repetition and the fifty move rule
+        self.repetition = self.positionCounts[self.boardLog[-1]] >= 3
+        self.fiftyMoveRule = self.halfmoveClock >= 100 and not self.checkmate
 
         self.enPassantPossible = tempEnPassantPossible
         self.currentCastleRights = tempCastleRights
+        self.movesGenerated += len(moves)
         return moves
         
 
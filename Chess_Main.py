@@ -1,9 +1,11 @@
 # This is the main driver file. It will be responsible for handling user input and displaying the current
 # GameState object.
 
+import argparse
 import pygame as p
 import Chess_Engine
 import Chess_AI
+import Chess_Stats
 
 boardWidth = boardHeight = 512
 moveLogPanelHeight = boardHeight
@@ -12,6 +14,7 @@ DIMENSION = 8 #Chess board is 8x8
 SQ_SIZE = boardHeight // DIMENSION
 MAX_FPS = 15 #For animations later
 IMAGES = {}
+findAIMove = Chess_AI.findBestMove # Chess_AI.findBestMoveMCTS with --mcts
 
 # Load in images and inisialise a global dictionary of images. We don't want to do this multiple times.
 # as in pygame it is an expensive operation.
@@ -44,7 +47,7 @@ def main():
     moveLogFont = p.font.SysFont("Arial", 16, False, False)
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
-        gameOver = gs.checkmate or gs.stalemate or gs.repetition
+        gameOver = gs.checkmate or gs.stalemate or gs.repetition or gs.fiftyMoveRule
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
@@ -89,8 +92,9 @@ def main():
                     running = False
         # AI move finder
         if not gameOver and not humanTurn:
-            AIMove = Chess_AI.findBestMove(gs, validMoves)
+            AIMove = findAIMove(gs, validMoves)
             if AIMove is None: AIMove = Chess_AI.findRandomMove(validMoves)
+            Chess_Stats.recordMove(gs, Chess_AI.searchStats, AIMove)
             gs.makeMove(AIMove)
             boardChange = True
             animate = True
@@ -116,6 +120,9 @@ def main():
         elif gs.repetition:
             gameOver = True
             drawEndGameText(screen, "Draw by repetition")
+        elif gs.fiftyMoveRule:
+            gameOver = True
+            drawEndGameText(screen, "Draw by fifty-move rule")
 
         clock.tick(MAX_FPS)
         p.display.flip()
@@ -219,15 +226,12 @@ def drawEndGameText(screen, text):
     textLocation = p.Rect(0, 0, boardHeight, boardHeight).move(boardWidth/2 - textObject.get_width()/2, boardHeight/2 - textObject.get_height()/2)
     screen.blit(textObject, textLocation)
 
-import cProfile
-cProfile.run("main()", "output.dat")
-
-import pstats
-from pstats import SortKey
-with open("output_time.txt", "w") as f:
-    p = pstats.Stats("output.dat", stream=f)
-    p.sort_stats("time").print_stats()
-with open("output_calls.txt", "w") as f:
-    p = pstats.Stats("output.dat", stream=f)
-    p.sort_stats("calls").print_stats()
-
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play chess against the AI")
+    parser.add_argument("--stats", metavar="FILE", help="append the search stats of every AI move to FILE as JSON lines")
+    parser.add_argument("--profile", metavar="FILE", help="run the game under cProfile and write the results to FILE")
+    parser.add_argument("--mcts", action="store_true", help="use Monte Carlo tree search instead of alpha-beta")
+    args = parser.parse_args()
+    if args.mcts: findAIMove = Chess_AI.findBestMoveMCTS
+    Chess_Stats.enable(stats=args.stats, profile=args.profile)
+    Chess_Stats.run(main)
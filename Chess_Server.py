@@ -0,0 +1,235 @@
+# This is a local analysis server, so other programs can use the engine without pygame.
+# Clients connect over TCP and send one JSON request per line:
+#   {"id": 1, "fen": "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1", "depth": 3}
+#   {"id": 2, "moves": ["e2e4", "e7e5"], "movetime": 2}
+#   {"id": 3, "moves": ["d2d4"], "mode": "mcts", "nodes": 500}
+#   {"cancel": 1}
+# and get one JSON reply per line for every search, in the order they finish:
+#   {"id": 1, "bestmove": "g8f6", "score": -0.41, "depth": 3, "nodes": 1288, "nps": 1049, "time": 1.23}
+# Searches run in a pool of worker processes which keep the engine loaded between requests.
+# Identical requests that are in flight at the same time share one search. When too many searches are
+# waiting for a worker, new ones are answered straight away with {"id": 4, "error": "busy"}.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Runs in the worker processes
+def workerLoop(conn, cancelEvent):
+    import Chess_Engine
+    import Chess_AI
+    Chess_AI.stopEvent = cancelEvent
+    gs = Chess_Engine.GameState()
+    while True:
+        request = conn.recv()
+        if request is None: break
+        try:
+            result = analyse(gs, request)
+        except Exception as e:
+            result = {"error": str(e)}
+        conn.send(result)
+
+
+def analyse(gs, request):
+    import Chess_AI
+    import Chess_Stats
+    if "fen" in request:
+        gs.loadFen(request["fen"])
+    else:
+        gs.__init__()
+    for notation in request.get("moves", []):
+        moves = [move for move in gs.getValidMoves() if move.getChessNotation() == notation[:4]] # Always promotes to a queen
+        if len(moves) == 0:
+            raise ValueError("Illegal move: " + notation)
+        gs.makeMove(moves[0])
+    validMoves = gs.getValidMoves()
+    if len(validMoves) == 0:
+        return {"bestmove": None, "score": Chess_AI.scoreBoard(gs)}
+    if request.get("mode") == "mcts":
+        move = Chess_AI.findBestMoveMCTS(gs, validMoves, playouts=request.get("nodes"),
+                                         movetime=request.get("movetime"))
+    else:
+        move = Chess_AI.findBestMove(gs, validMoves, depth=request.get("depth"),
+                                     movetime=request.get("movetime"), nodes=request.get("nodes"))
+    stats = Chess_Stats.getStats(gs, Chess_AI.searchStats)
+    return {"bestmove": move.getChessNotation(), "score": stats["score"], "depth": stats["depth"],
+            "nodes": stats["nodes"], "nps": stats["nps"], "time": round(stats["time"], 3)}
+
+
+class Worker():
+    def __init__(self):
+        self.conn, childConn = multiprocessing.Pipe()
+        self.cancelEvent = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=workerLoop, args=(childConn, self.cancelEvent), daemon=True)
+        self.process.start()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive(): self.process.terminate()
+
+
+class Job():
+    def __init__(self, key, request, future):
+        self.key = key
+        self.request = request
+        self.future = future
+        self.subscribers = 1 # Number of client requests waiting on this search
+        self.cancelled = False
+        self.worker = None # The worker running the search, None while it is queued
+        self.queued = True # Waiting for a worker, counted in AnalysisServer.queued
+
+
+class AnalysisServer():
+    def __init__(self, workers=None, queueSize=None):
+        self.workerCount = workers or os.cpu_count() or 1
+        self.queueSize = queueSize or self.workerCount*4
+        self.workers = []
+        self.jobs = {} # Jobs in flight by key, for sharing identical requests
+        self.queued = 0 # Jobs waiting for a worker that haven't been cancelled
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(self.workerCount) # Threads waiting on worker replies
+        runners = []
+        for i in range(self.workerCount):
+            self.workers.append(Worker())
+            runners.append(asyncio.create_task(self.runWorker(i)))
+        server = await asyncio.start_server(self.handleClient, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for runner in runners: runner.cancel()
+            for worker in self.workers: worker.stop()
+            self.executor.shutdown(wait=False)
+
+    async def runWorker(self, index):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.cancelled: continue
+            job.queued = False
+            self.queued -= 1
+            worker = self.workers[index]
+            worker.cancelEvent.clear()
+            job.worker = worker
+            try:
+                worker.conn.send(job.request)
+                result = await loop.run_in_executor(self.executor, worker.conn.recv)
+            except (EOFError, OSError):
+                result = {"error": "worker died"}
+                worker.stop()
+                self.workers[index] = Worker()
+            job.worker = None
+            if self.jobs.get(job.key) is job: del self.jobs[job.key]
+            if not job.future.done(): job.future.set_result(result)
+
+    # Returns the job for the request, sharing one that is already in flight if there is one.
+    # Returns None if the queue is full
+    def submit(self, request):
+        key = json.dumps([request.get(field) for field in ["fen", "moves", "mode", "depth", "movetime", "nodes"]])
+        job = self.jobs.get(key)
+        if job is not None:
+            job.subscribers += 1
+            return job
+        if self.queued >= self.queueSize: return None
+        job = Job(key, request, asyncio.get_running_loop().create_future())
+        self.jobs[key] = job
+        self.queued += 1
+        self.queue.put_nowait(job)
+        return job
+
+    # Drops a subscriber, cancelling the search when nobody is waiting for it anymore
+    def release(self, job):
+        job.subscribers -= 1
+        if job.subscribers > 0: return
+        job.cancelled = True
+        if job.queued:
+            job.queued = False
+            self.queued -= 1 # It stays in the asyncio queue but runWorker skips it
+        if job.worker is not None: job.worker.cancelEvent.set()
+        if self.jobs.get(job.key) is job: del self.jobs[job.key]
+        job.future.cancel()
+
+    async def handleClient(self, reader, writer):
+        requests = {} # Searches still running for this client by request id, as (job, reply task). Requests without an id can't be cancelled
+        writeLock = asyncio.Lock()
+
+        async def send(reply):
+            async with writeLock:
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+
+        async def reply(requestId, key, job):
+            try:
+                result = await asyncio.shield(job.future)
+            except asyncio.CancelledError:
+                return # Cancelled by the loop below, which releases the job and replies itself
+            del requests[key]
+            try:
+                await send(dict(result, id=requestId))
+            except ConnectionError:
+                pass
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict): raise ValueError("Request must be a JSON object")
+                    for field in ["id", "cancel"]:
+                        if not isinstance(request.get(field), (str, int, type(None))):
+                            raise ValueError(field + " must be a string or an integer")
+                except ValueError as e:
+                    await send({"error": str(e)})
+                    continue
+                if "cancel" in request:
+                    entry = requests.pop(request["cancel"], None)
+                    if entry is not None:
+                        job, task = entry
+                        task.cancel()
+                        self.release(job)
+                        await send({"id": request["cancel"], "error": "cancelled"})
+                    continue
+                requestId = request.get("id")
+                if requestId is not None and requestId in requests:
+                    await send({"id": requestId, "error": "A search with this id is already running"})
+                    continue
+                job = self.submit(request)
+                if job is None:
+                    await send({"id": requestId, "error": "busy"})
+                    continue
+                key = requestId if requestId is not None else object() # A key no cancel can match
+                requests[key] = (job, asyncio.create_task(reply(requestId, key, job)))
+        except ConnectionError:
+            pass
+        finally:
+            # The client is gone, stop its searches without replying
+            for job, task in requests.values():
+                task.cancel()
+                self.release(job)
+            await asyncio.gather(*[task for job, task in requests.values()], return_exceptions=True)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the chess engine as a local analysis server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--queue", type=int, help="number of searches that can wait for a worker before new ones are refused (default: 4 per worker)")
+    args = parser.parse_args()
+    asyncio.run(AnalysisServer(args.workers, args.queue).serve(args.host, args.port))
@@ -0,0 +1,57 @@
+# This file is responsible for the optional instrumentation of the engine and the AI.
+# Nothing here runs unless it is switched on, either with the command line flags of Chess_Main
+# (--stats FILE, --profile FILE) or with the environment variables CHESS_STATS and CHESS_PROFILE.
+# The counters themselves live on the GameState and in Chess_AI.searchStats, this file only reads them.
+# Everything in a record is for the last search except the game* fields, which are totals for the whole game.
+
+import os
+import json
+import time
+
+statsFile = os.environ.get("CHESS_STATS") or None # File to dump the stats of every AI move to (one JSON object per line)
+profileFile = os.environ.get("CHESS_PROFILE") or None # File to write the cProfile output to
+
+
+def enable(stats=None, profile=None):
+    global statsFile, profileFile
+    if stats: statsFile = stats
+    if profile: profileFile = profile
+
+
+# Returns a snapshot of all the counters as a dictionary
+def getStats(gs, searchStats):
+    stats = dict(searchStats)
+    stats["gameMakeMove"] = gs.makeMoveCalls
+    stats["gameUndoMove"] = gs.undoMoveCalls
+    stats["gameMovesGenerated"] = gs.movesGenerated
+    stats["nps"] = round(searchStats["nodes"]/searchStats["time"]) if searchStats["time"] > 0 else 0
+    return stats
+
+
+# Appends the stats for the move the AI just found to the stats file
+def recordMove(gs, searchStats, move):
+    if statsFile is None:
+        return
+    stats = getStats(gs, searchStats)
+    stats["ply"] = len(gs.moveLog)
+    stats["move"] = move.getChessNotation()
+    stats["timestamp"] = time.time()
+    with open(statsFile, "a") as f:
+        f.write(json.dumps(stats) + "\n")
+
+
+# Runs function, under cProfile if profiling has been asked for
+def run(function):
+    if profileFile is None:
+        return function()
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(profileFile)
+        with open(profileFile + "_time.txt", "w") as f:
+            pstats.Stats(profileFile, stream=f).sort_stats("time").print_stats()
+        with open(profileFile + "_calls.txt", "w") as f:
+            pstats.Stats(profileFile, stream=f).sort_stats("calls").print_stats()